@@ -7,15 +7,28 @@
 # - Exports clean PDF with 0.5" left/right margins
 # ----------------------------------------------------------------
 
+import concurrent.futures
+import functools
+import hashlib
+import io
 import os
+import pickle
+import re
+import shelve
+import threading
+import time
 from datetime import datetime
+from itertools import chain
 from textwrap import dedent
 
+import httpx
+import numpy as np
 import streamlit as st  # ✅ REQUIRED
 from dotenv import load_dotenv  # ✅ REQUIRED
 from openai import OpenAI  # ✅ REQUIRED
 
 # PDF generation (install: pip install reportlab)
+from reportlab import rl_config
 from reportlab.lib.pagesizes import LETTER
 from reportlab.lib.units import inch
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
@@ -37,13 +50,36 @@ except ImportError as e:
         "  pip install -r requirements.txt\n\n"
         f"Details: {e}\n"
     )
-print(f"API Key loaded: {os.getenv('OPENAI_API_KEY')[:10]}..." if os.getenv('OPENAI_API_KEY') else "No API key found!")
 
-# -------------------------
-# ENV & CLIENT
-# -------------------------
-load_dotenv()  # reads .env if present
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Optional faster PDF engine: markdown -> HTML -> xhtml2pdf skips the
+# manual markdown->flowable translation entirely. ReportLab remains the
+# fallback when these aren't installed.
+try:
+    import markdown2
+    from xhtml2pdf import pisa
+    _HAS_XHTML2PDF = True
+except ImportError:
+    _HAS_XHTML2PDF = False
+
+# Optional exact token counting; a chars/4 heuristic covers its absence.
+try:
+    import tiktoken
+    _HAS_TIKTOKEN = True
+except ImportError:
+    _HAS_TIKTOKEN = False
+
+# Optional fast JSON for formatting usage stats; stdlib json otherwise.
+try:
+    import orjson
+    _HAS_ORJSON = True
+except ImportError:
+    import json
+    _HAS_ORJSON = False
+# ReportLab validates every attribute set on every shape/flowable when
+# shapeChecking is on; an itinerary PDF builds hundreds of flowables, so
+# skip that outside debug runs.
+if not os.getenv("TRAVEL_GUIDE_DEBUG"):
+    rl_config.shapeChecking = 0
 
 # -------------------------
 # STREAMLIT CONFIG
@@ -54,6 +90,47 @@ st.set_page_config(
     layout="centered",
 )
 
+# -------------------------
+# ENV & CLIENT
+# -------------------------
+@st.cache_resource(show_spinner=False)
+def get_client():
+    """
+    Create the OpenAI client once per process. Streamlit re-executes the
+    whole script on every interaction; caching here avoids re-reading .env
+    and rebuilding the HTTPX pool/TLS context, so keepalive connections to
+    the API are reused across reruns.
+    """
+    load_dotenv()  # reads .env if present
+    api_key = os.getenv("OPENAI_API_KEY")
+    try:
+        # HTTP/2 multiplexes the hedged and per-day fan-out requests over
+        # one connection: a single TLS handshake instead of one per call.
+        http_client = httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+            timeout=httpx.Timeout(60.0, connect=5.0),
+        )
+    except ImportError:
+        # h2 isn't installed; the SDK's default HTTP/1.1 client still works
+        return OpenAI(api_key=api_key, timeout=60.0, max_retries=2)
+    return OpenAI(api_key=api_key, http_client=http_client, max_retries=2)
+
+client = get_client()
+
+def _format_usage(usage):
+    """Compact JSON rendering of usage stats (SDK object or fan-out dict)."""
+    if isinstance(usage, dict):
+        data = usage
+    else:
+        try:
+            data = usage.model_dump(exclude_none=True)
+        except Exception:
+            return str(usage)
+    if _HAS_ORJSON:
+        return orjson.dumps(data).decode()
+    return json.dumps(data, separators=(",", ":"))
+
 FORM_KEYS = [
     "destination",
     "num_days",
@@ -73,6 +150,9 @@ def reset_all_callback():
     st.session_state["travel_plan"] = ""
     st.session_state.pop("last_model_used", None)
     st.session_state.pop("last_usage", None)
+    st.session_state.pop("_pdf_bytes", None)
+    st.session_state.pop("_pdf_plan", None)
+    st.session_state.pop("_generation_interrupted", None)
 
 init_form_state()
 
@@ -90,6 +170,12 @@ with st.expander("What this app does", expanded=False):
 # -------------------------
 # PROMPTS
 # -------------------------
+# NOTE: keep this prompt byte-for-byte identical between requests and keep
+# all trip-specific details in the user message. OpenAI caches long shared
+# prompt prefixes (>=1024 tokens) server-side, so an invariant system
+# prompt above that threshold gets ~50% cheaper input tokens and faster
+# time-to-first-token on every request after the first. The rubric and
+# example below are deliberately verbose for that reason.
 SYSTEM_PROMPT = dedent("""
 You are an experienced and enthusiastic TRAVEL GUIDE PLANNER.
 
@@ -109,19 +195,96 @@ Output format in Markdown with these top-level H2 sections (##):
 ## Travel Tips & Recommendations
 ## Estimated Budget Overview
 ## Important Notes & Reminders
+
+SECTION RUBRIC (follow for every itinerary, regardless of destination):
+
+## Trip Overview
+- Two to four sentences summarizing the destination's character and why it
+  suits the traveler's stated interests
+- Mention the best season or time of day considerations if relevant
+- State the overall pace of the plan (relaxed, moderate, or packed) and why
+- Do not repeat the raw form inputs verbatim; weave them into prose
+
+## Day-by-Day Itinerary
+- One H3 subsection per day, titled "### Day N" with an optional short
+  theme after a colon (for example "### Day 2: Old Town & Markets")
+- Each day is organized into Morning, Afternoon, and Evening blocks
+- Each block names one or two concrete places with a one-line reason to go,
+  an estimated visit duration, and typical opening hours when known
+- Include at least one food recommendation per day (restaurant, cafe,
+  market stall, or dish) that fits the traveler's constraints
+- Note the travel leg between blocks when it exceeds roughly 20 minutes,
+  with the usual mode of transport (walk, metro, taxi, regional train)
+- Flag anything that normally requires advance booking or sells out
+- Alternate intense and light activities so no day is wall-to-wall
+
+## Travel Tips & Recommendations
+- Four to eight bullets covering local transport passes, etiquette,
+  tipping norms, common scams or tourist traps to avoid, weather-
+  appropriate clothing, and connectivity (SIM/eSIM availability)
+- Prefer tips specific to the destination over generic travel advice
+
+## Estimated Budget Overview
+- Bullet list of rough per-day ranges in the local currency (and USD when
+  the local currency is uncommon) for lodging, food, attractions, and
+  local transport
+- State clearly that figures are estimates and seasonal
+
+## Important Notes & Reminders
+- Safety, health, visa/entry, and accessibility notes relevant to the trip
+- Restate every user guardrail and how the plan honors it
+
+GUARDRAIL HANDLING:
+- Treat every user constraint as hard, not advisory: if the user says no
+  walking tours, no itinerary item may be a walking tour
+- Accessibility constraints (wheelchair access, step-free routes, limited
+  mobility) apply to every venue, restaurant, and transport suggestion
+- Dietary constraints apply to every food recommendation, including
+  snacks and market stalls
+- Budget constraints shift recommendations toward free sights, public
+  transport, and affordable eateries; say so where it changes a choice
+- When a constraint conflicts with a stated interest, honor the
+  constraint and briefly offer the closest compliant alternative
+- Never silently drop a constraint; the Important Notes section must
+  account for all of them
+
+STYLE RULES:
+- Markdown only; never emit HTML tags
+- Use "-" for every bullet; do not use numbered lists
+- Bold place names on first mention; do not bold anything else
+- No tables, no blockquotes, no horizontal rules, no emoji in headings
+- Keep paragraphs to three sentences or fewer
+- Never invent precise prices, phone numbers, or exact addresses; give
+  ranges and neighborhood-level locations instead
+- If the destination is ambiguous (for example "Springfield"), pick the
+  most famous match and say so in the Trip Overview
+
+EXAMPLE DAY (structure to imitate; replace all content):
+### Day 1: Arrival & City Center
+Morning: Arrive and drop bags at the hotel. Stroll the **Main Square**
+(1-2 hours) to get oriented; most cafes around it open by 08:00.
+Afternoon: Visit the **City Museum** (2 hours, open 10:00-18:00, closed
+Mondays; book online to skip the line). Walk 15 minutes through the old
+quarter on the way back.
+Evening: Dinner at a traditional tavern near the river — try the local
+dumplings. Finish with a riverside walk if the weather cooperates.
+
+After the final section, output a line containing exactly:
+## End
 """).strip()
 
-def build_user_prompt(destination, num_days, special_interests, guardrails):
-    return dedent(f"""
+# Template is dedented/stripped once at import; build_user_prompt only has
+# to fill in the blanks instead of re-scanning the whole string per call.
+_USER_TMPL = dedent("""
 TRAVEL DETAILS
-- Destination: {destination or 'N/A'}
-- Number of Days: {num_days or 'N/A'}
+- Destination: {destination}
+- Number of Days: {num_days}
 
 INTERESTS & PREFERENCES
-- Special Interests: {special_interests or 'General sightseeing'}
+- Special Interests: {special_interests}
 
 CONSTRAINTS / GUARDRAILS
-{guardrails or 'None specified'}
+{guardrails}
 
 INSTRUCTIONS
 - Create a complete itinerary covering all {num_days} days
@@ -135,6 +298,241 @@ INSTRUCTIONS
 - Total length: approximately 800-1500 words
 """).strip()
 
+def build_user_prompt(destination, num_days, special_interests, guardrails):
+    return _USER_TMPL.format(
+        destination=destination or "N/A",
+        num_days=num_days or "N/A",
+        special_interests=special_interests or "General sightseeing",
+        guardrails=guardrails or "None specified",
+    )
+
+# -------------------------
+# TOKEN BUDGETS
+# -------------------------
+STOP_SENTINEL = "## End"   # the model halts the moment the structure is done
+TOKENS_PER_DAY = 300       # rough itinerary cost per day of trip
+MIN_COMPLETION_TOKENS = 600
+MAX_COMPLETION_TOKENS = 2500
+MAX_PROMPT_TOKENS = 4000
+
+_DAYS_RE = re.compile(r"\d+")
+
+def _estimate_max_tokens(num_days):
+    """
+    Scale the completion budget with trip length instead of always paying
+    for the full 2500-token ceiling; a 2-day trip stops far sooner.
+    """
+    m = _DAYS_RE.search(str(num_days or ""))
+    days = int(m.group()) if m else 3
+    return max(MIN_COMPLETION_TOKENS, min(MAX_COMPLETION_TOKENS, TOKENS_PER_DAY * days))
+
+@functools.lru_cache(maxsize=4)
+def _token_encoder(model_name):
+    return tiktoken.encoding_for_model(model_name)
+
+def _count_tokens(text):
+    if _HAS_TIKTOKEN:
+        try:
+            return len(_token_encoder("gpt-4o").encode(text))
+        except Exception:
+            pass
+    return len(text) // 4  # rough chars-per-token fallback
+
+def _check_prompt_size(user_prompt):
+    if _count_tokens(user_prompt) > MAX_PROMPT_TOKENS:
+        raise ValueError(
+            "Your trip details are too long. Please shorten the special "
+            "interests and guardrails fields."
+        )
+
+# -------------------------
+# RESPONSE CACHE
+# -------------------------
+CACHE_DIR = os.path.expanduser("~/.travel_guide_cache")
+CACHE_TTL_S = 86400  # cached itineraries stay fresh for one day
+
+# One shelve handle is shared by every session thread and the fan-out
+# workers, and shelve/dbm is not safe for concurrent access — unguarded
+# writes can corrupt the file and silently kill the cache. All reads and
+# writes go through this lock.
+_CACHE_LOCK = threading.Lock()
+
+@st.cache_resource(show_spinner=False)
+def _response_cache():
+    """
+    Disk-backed exact-match cache (survives reruns and app restarts).
+    Stores only the extracted markdown text, never SDK objects.
+    """
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return shelve.open(os.path.join(CACHE_DIR, "responses"))
+
+def _cache_key(model, user_prompt):
+    raw = model + SYSTEM_PROMPT + user_prompt
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _cache_get(cache, key):
+    try:
+        with _CACHE_LOCK:
+            ts, text = cache[key]
+    except Exception:
+        return None
+    if time.time() - ts > CACHE_TTL_S:
+        return None
+    return text
+
+def _cache_put(cache, key, text):
+    try:
+        with _CACHE_LOCK:
+            cache[key] = (time.time(), text)
+            cache.sync()
+    except Exception:
+        pass  # a cache failure must never break generation
+
+# -------------------------
+# SEMANTIC CACHE
+# -------------------------
+EMBEDDING_MODEL = "text-embedding-3-small"
+SEMANTIC_SIM_THRESHOLD = 0.92  # cosine similarity to count as "same trip"
+
+# Like the shelve store, the semantic cache is one process-wide singleton
+# shared by every session thread; the lock keeps the embeddings matrix and
+# the entries list from drifting out of step under concurrent adds.
+_SEMANTIC_LOCK = threading.Lock()
+
+class _SemanticCache:
+    """
+    Near-duplicate prompt cache: keeps an L2-normalized float32 embedding
+    matrix and a parallel list of entries ({"text", "days", "ts"}),
+    persisted to disk so hits survive reruns. Lookup is one masked
+    matrix-vector product + argmax; entries for a different day count or
+    past the TTL never match.
+    """
+    def __init__(self, path_prefix):
+        self._emb_path = path_prefix + "_embeddings.npy"
+        self._txt_path = path_prefix + "_entries.pkl"
+        try:
+            self.embeddings = np.load(self._emb_path)
+            with open(self._txt_path, "rb") as f:
+                self.entries = pickle.load(f)
+            if len(self.entries) != len(self.embeddings):
+                raise ValueError("embeddings/entries length mismatch")
+        except Exception:
+            self.embeddings = np.empty((0, 0), dtype=np.float32)
+            self.entries = []
+
+    def lookup(self, query_vec, days):
+        with _SEMANTIC_LOCK:
+            if not self.entries:
+                return None
+            now = time.time()
+            valid = np.array(
+                [e["days"] == days and now - e["ts"] <= CACHE_TTL_S for e in self.entries],
+                dtype=bool,
+            )
+            if not valid.any():
+                return None
+            sims = np.where(valid, self.embeddings @ query_vec, -1.0)
+            best = int(np.argmax(sims))
+            if sims[best] >= SEMANTIC_SIM_THRESHOLD:
+                return self.entries[best]["text"]
+            return None
+
+    def add(self, query_vec, text, days):
+        row = query_vec.reshape(1, -1)
+        with _SEMANTIC_LOCK:
+            try:
+                if self.entries:
+                    self.embeddings = np.vstack([self.embeddings, row])
+                else:
+                    self.embeddings = row
+                self.entries.append({"text": text, "days": days, "ts": time.time()})
+                np.save(self._emb_path, self.embeddings)
+                with open(self._txt_path, "wb") as f:
+                    pickle.dump(self.entries, f)
+            except Exception:
+                pass  # best-effort: never fail a finished generation
+
+@st.cache_resource(show_spinner=False)
+def _semantic_cache():
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    return _SemanticCache(os.path.join(CACHE_DIR, "semantic"))
+
+def _embed_text(text):
+    """
+    Embed and L2-normalize a short text; returns None if the embeddings
+    API is unavailable (semantic caching is strictly optional).
+    """
+    try:
+        resp = client.embeddings.create(model=EMBEDDING_MODEL, input=text)
+        vec = np.asarray(resp.data[0].embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vec))
+        return vec / norm if norm else vec
+    except Exception:
+        return None
+
+def _semantic_text_from_state():
+    """
+    Only the variable form fields get embedded. Embedding the full user
+    prompt would let its invariant boilerplate dominate the vector and
+    make materially different trips look near-identical.
+    """
+    return " | ".join([
+        st.session_state.get("destination", ""),
+        st.session_state.get("num_days", ""),
+        st.session_state.get("special_interests", ""),
+        st.session_state.get("guardrails", ""),
+    ])
+
+def semantic_lookup(semantic_text, days):
+    """
+    Return (cached_itinerary_or_None, query_vec_or_None). The vector is
+    handed back so a fresh generation can be added without re-embedding.
+    """
+    query_vec = _embed_text(semantic_text)
+    if query_vec is None:
+        return None, None
+    try:
+        return _semantic_cache().lookup(query_vec, days), query_vec
+    except Exception:
+        # a bad cache must never break generation; miss and regenerate
+        return None, query_vec
+
+# -------------------------
+# TRIP CACHE
+# -------------------------
+# Whole-trip entries keyed by the raw form fields, holding the rendered
+# markdown plus (once built) the PDF bytes. A hit skips the LLM call and
+# the PDF engine entirely. Shares the shelve store with the response cache
+# under a distinct key prefix.
+
+def _trip_key(destination, num_days, special_interests, guardrails):
+    raw = "|".join([destination or "", num_days or "", special_interests or "", guardrails or ""])
+    return "trip:" + hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+def _trip_key_from_state():
+    return _trip_key(
+        st.session_state.get("destination", ""),
+        st.session_state.get("num_days", ""),
+        st.session_state.get("special_interests", ""),
+        st.session_state.get("guardrails", ""),
+    )
+
+def _trip_cache_get():
+    return _cache_get(_response_cache(), _trip_key_from_state())
+
+def _trip_cache_put_markdown(markdown, model):
+    _cache_put(_response_cache(), _trip_key_from_state(),
+               {"markdown": markdown, "pdf": None, "model": model})
+
+def _trip_cache_put_pdf(pdf_bytes):
+    cache = _response_cache()
+    key = _trip_key_from_state()
+    entry = _cache_get(cache, key)
+    # only attach the PDF if the entry still matches the plan on screen
+    if entry and entry.get("markdown") == st.session_state.get("travel_plan"):
+        entry["pdf"] = pdf_bytes
+        _cache_put(cache, key, entry)
+
 # -------------------------
 # FALLBACKS & EXTRACTOR
 # -------------------------
@@ -162,90 +560,505 @@ def _extract_text_from_chat_completion(comp):
         pass
     return ""
 
-def get_travel_plan_markdown(user_prompt):
+# -------------------------
+# MODEL HEALTH
+# -------------------------
+FAILURE_THRESHOLD = 3         # consecutive failures before a model is benched
+SKIP_WINDOW_S = 120.0         # how long a benched model is skipped
+HEALTHCHECK_INTERVAL_S = 60.0  # background ping cadence for benched models
+
+def _healthcheck_loop(health):
+    """
+    Daemon loop: periodically ping benched models with a tiny completion
+    and put them back in rotation as soon as they answer.
+    """
+    while True:
+        time.sleep(HEALTHCHECK_INTERVAL_S)
+        now = time.time()
+        for model_name, state in health.items():
+            if state["skip_until"] <= now:
+                continue
+            try:
+                client.chat.completions.create(
+                    model=model_name,
+                    messages=[{"role": "user", "content": "ping"}],
+                    max_tokens=3,
+                )
+            except Exception:
+                continue
+            state["fails"] = 0
+            state["skip_until"] = 0.0
+
+@st.cache_resource(show_spinner=False)
+def _model_health():
+    health = {m: {"fails": 0, "skip_until": 0.0} for m in FALLBACK_MODELS}
+    threading.Thread(target=_healthcheck_loop, args=(health,), daemon=True).start()
+    return health
+
+def _healthy_models():
+    """Fallback order minus anything currently benched (never empty)."""
+    health = _model_health()
+    now = time.time()
+    models = [m for m in FALLBACK_MODELS if health[m]["skip_until"] <= now]
+    return models or list(FALLBACK_MODELS)
+
+def _record_success(model_name, health=None):
+    state = (health or _model_health())[model_name]
+    state["fails"] = 0
+    state["skip_until"] = 0.0
+
+def _record_failure(model_name, health=None):
+    state = (health or _model_health())[model_name]
+    state["fails"] += 1
+    if state["fails"] >= FAILURE_THRESHOLD:
+        state["skip_until"] = time.time() + SKIP_WINDOW_S
+
+# -------------------------
+# HEDGED DISPATCH
+# -------------------------
+HEDGE_DELAY_S = 3.0  # how long the primary gets before the hedge fires
+
+@st.cache_resource(show_spinner=False)
+def _hedge_executor():
+    return concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+def _open_stream(model_name, messages, max_tokens=MAX_COMPLETION_TOKENS):
+    """
+    Open a streaming completion and pull its first chunk, so the future
+    resolves at time-to-first-token rather than at request submission.
+    """
+    stream = client.chat.completions.create(
+        model=model_name,
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=0.7,
+        stop=[STOP_SENTINEL],
+        stream=True,
+        # final chunk carries usage, incl. prompt_tokens_details.cached_tokens
+        # — the only way to verify server-side prompt caching is kicking in
+        stream_options={"include_usage": True},
+    )
+    first = next(stream, None)
+    return stream, first
+
+def _close_stream_future(fut):
+    """Done-callback: close the losing hedge's HTTP stream."""
+    try:
+        stream, _first = fut.result()
+        stream.close()
+    except Exception:
+        pass
+
+def _acquire_stream_hedged(messages, models, max_tokens=MAX_COMPLETION_TOKENS):
     """
-    Robust call with model fallbacks and modern parameters.
+    Open the primary model's stream; if no first token arrives within
+    HEDGE_DELAY_S, also open the secondary and race them. Returns
+    (model_name, stream, first_chunk) for whichever wins, closing the
+    loser. Only hedging after the delay keeps the fast path at one call.
     """
+    executor = _hedge_executor()
+    primary = models[0]
+    secondary = models[1] if len(models) > 1 else None
+    futures = {executor.submit(_open_stream, primary, messages, max_tokens): primary}
+    hedged = secondary is None
+    last_error = None
+    while futures:
+        done, _pending = concurrent.futures.wait(
+            futures,
+            timeout=None if hedged else HEDGE_DELAY_S,
+            return_when=concurrent.futures.FIRST_COMPLETED,
+        )
+        if not done:
+            futures[executor.submit(_open_stream, secondary, messages, max_tokens)] = secondary
+            hedged = True
+            continue
+        for fut in done:
+            model_name = futures.pop(fut)
+            try:
+                stream, first = fut.result()
+            except Exception as e:
+                _record_failure(model_name)
+                last_error = e
+                continue
+            for loser in list(futures):
+                del futures[loser]
+                if not loser.cancel():
+                    loser.add_done_callback(_close_stream_future)
+            return model_name, stream, first
+        if not hedged and not futures:
+            # primary failed outright before the hedge timer elapsed
+            futures[executor.submit(_open_stream, secondary, messages, max_tokens)] = secondary
+            hedged = True
+    raise last_error or RuntimeError("No models available for hedged dispatch.")
+
+def stream_travel_plan(user_prompt, num_days=None):
+    """
+    Yields markdown chunks as the model produces them, so the UI can render
+    while generation is still running. Cache hits (exact or semantic) yield
+    the full plan as a single chunk; on completion the assembled text goes
+    back into both caches.
+    """
+    _check_prompt_size(user_prompt)
+    max_tokens = _estimate_max_tokens(num_days)
+    days = _parse_day_count(num_days)
+    cache = _response_cache()
+    for model_name in FALLBACK_MODELS:
+        cached = _cache_get(cache, _cache_key(model_name, user_prompt))
+        if cached:
+            st.session_state["last_model_used"] = f"{model_name} (cached)"
+            st.session_state["last_usage"] = None
+            yield cached
+            return
+
+    semantic_hit, query_vec = semantic_lookup(_semantic_text_from_state(), days)
+    if semantic_hit:
+        st.session_state["last_model_used"] = "semantic cache"
+        st.session_state["last_usage"] = None
+        yield semantic_hit
+        return
+
     messages = [
         {"role": "system", "content": SYSTEM_PROMPT},
         {"role": "user", "content": user_prompt},
     ]
-    
+
+    # Top-2 healthy models race via hedged dispatch; anything after that
+    # stays a plain sequential fallback. Benched models are skipped.
+    models = _healthy_models()
     last_error = None
-    for model_name in FALLBACK_MODELS:
+    acquired = None
+    try:
+        acquired = _acquire_stream_hedged(messages, models, max_tokens)
+    except Exception as e:
+        last_error = e
+    tail_models = list(models[2:])
+
+    while acquired is not None or tail_models:
+        if acquired is not None:
+            model_name, stream, first = acquired
+            acquired = None
+        else:
+            model_name = tail_models.pop(0)
+            try:
+                stream, first = _open_stream(model_name, messages, max_tokens)
+            except Exception as e:
+                _record_failure(model_name)
+                last_error = e
+                continue
+
+        parts = []
+        usage = None
+        try:
+            chunks = stream if first is None else chain([first], stream)
+            for chunk in chunks:
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage  # final chunk via include_usage
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            _record_failure(model_name)
+            if parts:
+                # Partial plan is already on screen; keep it as the result
+                # (uncached, flagged) rather than discarding it or lying
+                # that every model failed. Restarting mid-plan would churn.
+                st.session_state["last_model_used"] = f"{model_name} (interrupted)"
+                st.session_state["last_usage"] = usage
+                st.session_state["_generation_interrupted"] = True
+                st.warning(f"Generation was interrupted ({e}); the plan may be incomplete.")
+                return
+            last_error = e
+            continue
+
+        text = "".join(parts)
+        if text.strip():
+            _record_success(model_name)
+            st.session_state["last_model_used"] = model_name
+            st.session_state["last_usage"] = usage
+            _cache_put(cache, _cache_key(model_name, user_prompt), text)
+            if query_vec is not None:
+                _semantic_cache().add(query_vec, text, days)
+            return
+        last_error = RuntimeError(f"Model '{model_name}' returned empty content.")
+
+    raise RuntimeError(f"All model attempts failed. Last error: {last_error}")
+
+# -------------------------
+# PER-DAY FAN-OUT
+# -------------------------
+FANOUT_MIN_DAYS = 4        # below this, one streamed call is cheaper/faster
+MAX_FANOUT_DAYS = 14       # bound on parallel per-day calls
+DAY_SECTION_TOKENS = 400
+FRAME_SECTION_TOKENS = 900
+
+# Both task prompts are appended to the normal user prompt, keeping the
+# long system prompt byte-identical for server-side prefix caching.
+_FRAME_TASK = dedent("""
+TASK OVERRIDE
+- Generate ONLY these sections for the trip described above:
+  ## Trip Overview
+  ## Travel Tips & Recommendations
+  ## Estimated Budget Overview
+  ## Important Notes & Reminders
+- Do NOT generate the Day-by-Day Itinerary; it is produced separately
+""").strip()
+
+_DAY_TASK = dedent("""
+TASK OVERRIDE
+- From the trip described above, generate ONLY the "### Day {day}"
+  subsection of the Day-by-Day Itinerary (Morning/Afternoon/Evening)
+- Output exactly one H3 heading ("### Day {day}", optionally with a theme)
+  and no H2 sections, overview, tips, or budget
+- Other days are generated separately; spread marquee attractions across
+  the trip rather than anchoring every day on the same sight
+""").strip()
+
+@st.cache_resource(show_spinner=False)
+def _fanout_executor():
+    return concurrent.futures.ThreadPoolExecutor(max_workers=min(MAX_FANOUT_DAYS, 8))
+
+def _parse_day_count(num_days):
+    m = _DAYS_RE.search(str(num_days or ""))
+    if not m:
+        return None
+    return max(1, int(m.group()))
+
+def _section_completion(section_prompt, max_tokens, cache, models, health):
+    """
+    Blocking completion for one itinerary section, cached independently so
+    repeat trips hit per-day caches. Returns (text, usage_or_None); cache
+    hits report no usage. Runs on worker threads: all Streamlit
+    resources are passed in, and health is updated via the shared dict.
+    """
+    for model_name in models:
+        cached = _cache_get(cache, _cache_key(model_name, section_prompt))
+        if cached:
+            return cached, None
+
+    last_error = None
+    for model_name in models:
         try:
             comp = client.chat.completions.create(
                 model=model_name,
-                messages=messages,
-                max_tokens=2500,
+                messages=[
+                    {"role": "system", "content": SYSTEM_PROMPT},
+                    {"role": "user", "content": section_prompt},
+                ],
+                max_tokens=max_tokens,
                 temperature=0.7,
+                stop=[STOP_SENTINEL],
             )
             text = _extract_text_from_chat_completion(comp)
             if text.strip():
-                st.session_state["last_model_used"] = model_name
-                st.session_state["last_usage"] = getattr(comp, "usage", None)
-                return text
+                _record_success(model_name, health)
+                _cache_put(cache, _cache_key(model_name, section_prompt), text)
+                return text, getattr(comp, "usage", None)
             last_error = RuntimeError(f"Model '{model_name}' returned empty content.")
         except Exception as e:
+            _record_failure(model_name, health)
             last_error = e
-            continue
-    
-    raise RuntimeError(f"All model attempts failed. Last error: {last_error}")
+    raise RuntimeError(f"Section generation failed. Last error: {last_error}")
+
+def _tally_usage(totals, usage):
+    """Accumulate one completion's usage into the fan-out totals dict."""
+    if not usage:
+        return
+    for field in ("prompt_tokens", "completion_tokens", "total_tokens"):
+        totals[field] += getattr(usage, field, 0) or 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    if details:
+        totals["cached_tokens"] += getattr(details, "cached_tokens", 0) or 0
+
+def stream_travel_plan_fanout(user_prompt, days):
+    """
+    Map-reduce generation: one small completion per day plus a 'frame'
+    completion for the non-day sections, all submitted at once, stitched
+    back in order. Wall-clock latency is roughly one day's generation
+    instead of the whole trip's. Yields sections as they complete so the
+    UI still streams progressively.
+    """
+    cache = _response_cache()
+    full_key = _cache_key("fanout", user_prompt)
+    cached = _cache_get(cache, full_key)
+    if cached:
+        st.session_state["last_model_used"] = "fan-out (cached)"
+        st.session_state["last_usage"] = None
+        yield cached
+        return
+
+    semantic_hit, query_vec = semantic_lookup(_semantic_text_from_state(), days)
+    if semantic_hit:
+        st.session_state["last_model_used"] = "semantic cache"
+        st.session_state["last_usage"] = None
+        yield semantic_hit
+        return
+
+    executor = _fanout_executor()
+    models = _healthy_models()
+    health = _model_health()
+    frame_fut = executor.submit(
+        _section_completion,
+        user_prompt + "\n\n" + _FRAME_TASK,
+        FRAME_SECTION_TOKENS, cache, models, health,
+    )
+    day_futs = [
+        executor.submit(
+            _section_completion,
+            user_prompt + "\n\n" + _DAY_TASK.format(day=i),
+            DAY_SECTION_TOKENS, cache, models, health,
+        )
+        for i in range(1, days + 1)
+    ]
+
+    parts = []
+    usage_totals = {
+        "prompt_tokens": 0, "completion_tokens": 0,
+        "total_tokens": 0, "cached_tokens": 0,
+    }
+
+    def emit(text):
+        parts.append(text)
+        return text
+
+    # The frame holds the sections before and after the itinerary; split it
+    # so the day subsections land in the middle where they belong.
+    frame, frame_usage = frame_fut.result()
+    _tally_usage(usage_totals, frame_usage)
+    head, marker, tail = frame.partition("## Travel Tips")
+    yield emit(head.rstrip() + "\n\n## Day-by-Day Itinerary\n")
+    for fut in day_futs:
+        day_text, day_usage = fut.result()
+        _tally_usage(usage_totals, day_usage)
+        yield emit("\n" + day_text.strip() + "\n")
+    if marker:
+        yield emit("\n" + marker + tail)
+
+    text = "".join(parts)
+    st.session_state["last_model_used"] = f"fan-out ({days} days + frame)"
+    st.session_state["last_usage"] = usage_totals if usage_totals["total_tokens"] else None
+    _cache_put(cache, full_key, text)
+    if query_vec is not None:
+        _semantic_cache().add(query_vec, text, days)
+
+def stream_travel_plan_auto(user_prompt, num_days=None):
+    """
+    Route mid-length trips to per-day fan-out. Short trips are cheaper as
+    one streamed call; trips past MAX_FANOUT_DAYS also take the single
+    stream rather than silently generating only the first N days.
+    """
+    days = _parse_day_count(num_days)
+    if days and FANOUT_MIN_DAYS <= days <= MAX_FANOUT_DAYS:
+        return stream_travel_plan_fanout(user_prompt, days)
+    return stream_travel_plan(user_prompt, num_days)
 
 # -------------------------
 # PDF HELPERS
 # -------------------------
-def markdown_to_flowables(md_text, styles):
+# getSampleStyleSheet() is a known ReportLab hotspot when called per
+# document; build the stylesheet and derived styles once at import.
+_STYLES = getSampleStyleSheet()
+_BODY = _STYLES["BodyText"]
+_H2 = ParagraphStyle("H2", parent=_STYLES["Heading2"], spaceBefore=12, spaceAfter=6)
+_H3 = ParagraphStyle("H3", parent=_STYLES["Heading3"], spaceBefore=8, spaceAfter=4)
+_HEADER = ParagraphStyle(
+    "Header",
+    parent=_STYLES["Title"],
+    fontSize=18,
+    spaceAfter=12,
+)
+
+# One C-level pass over the whole text beats per-line startswith/lstrip
+# dispatch in Python: group(1) classifies each line as H3/H2/bullet/other,
+# and the surrounding [ \t]* runs trim group(2) inside the regex engine so
+# no per-line strip() allocation is needed afterwards.
+_LINE_RE = re.compile(r"^[ \t]*(### |## |[-*•])?[ \t]*(.*?)[ \t]*$", re.M)
+
+def markdown_to_flowables(md_text):
     """
-    Lightweight Markdown -> ReportLab flowables:
+    Lightweight Markdown -> ReportLab flowables, parsed in a single
+    precompiled-regex pass over the full text:
     - '## ' -> Heading2
     - '### ' -> Heading3
     - Bullets '-', '*', '•' -> unordered lists
     - Otherwise -> paragraph
     """
     flow = []
-    body = styles["BodyText"]
-    h2 = ParagraphStyle("H2", parent=styles["Heading2"], spaceBefore=12, spaceAfter=6)
-    h3 = ParagraphStyle("H3", parent=styles["Heading3"], spaceBefore=8, spaceAfter=4)
-    
-    lines = md_text.splitlines()
-    i = 0
-    while i < len(lines):
-        line = lines[i].rstrip()
-        
-        if not line.strip():
-            flow.append(Spacer(1, 6))
-            i += 1
-            continue
-        
-        if line.startswith("## "):
-            flow.append(Paragraph(line[3:].strip(), h2))
-            i += 1
-            continue
-        if line.startswith("### "):
-            flow.append(Paragraph(line[4:].strip(), h3))
-            i += 1
-            continue
-        
-        if line.lstrip().startswith(("-", "*", "•")):
-            items = []
-            while i < len(lines) and lines[i].lstrip().startswith(("-", "*", "•")):
-                bullet_text = lines[i].lstrip()[1:].strip()
-                items.append(ListItem(Paragraph(bullet_text, body), leftIndent=12))
-                i += 1
-            flow.append(ListFlowable(items, bulletType="bullet", start="•", leftIndent=6))
+    items = []  # pending bullet items, flushed as one ListFlowable
+
+    def flush_bullets():
+        if items:
+            flow.append(ListFlowable(list(items), bulletType="bullet", start="•", leftIndent=6))
             flow.append(Spacer(1, 4))
-            continue
-        
-        flow.append(Paragraph(line, body))
-        i += 1
-    
+            items.clear()
+
+    for m in _LINE_RE.finditer(md_text):
+        kind = m.group(1)
+        text = m.group(2)
+
+        if kind == "## ":
+            flush_bullets()
+            flow.append(Paragraph(text, _H2))
+        elif kind == "### ":
+            flush_bullets()
+            flow.append(Paragraph(text, _H3))
+        elif kind is not None:  # single bullet char
+            items.append(ListItem(Paragraph(text, _BODY), leftIndent=12))
+        elif text:
+            flush_bullets()
+            flow.append(Paragraph(text, _BODY))
+        else:
+            flush_bullets()
+            flow.append(Spacer(1, 6))
+
+    flush_bullets()
     return flow
 
-def write_pdf(markdown_text, destination, filename="travel_plan.pdf"):
+# Same page geometry as the ReportLab path: Letter, 0.5" left/right and
+# 0.7" top/bottom margins.
+_PDF_HTML_TMPL = """<html>
+<head>
+<title>Travel Guide - {destination}</title>
+<style>
+@page {{ size: Letter; margin: 0.7in 0.5in 0.7in 0.5in; }}
+body {{ font-family: Helvetica, sans-serif; font-size: 10pt; }}
+h1 {{ font-size: 18pt; }}
+</style>
+</head>
+<body>
+<h1>Travel Guide: {destination}</h1>
+<p>{meta}</p>
+{body}
+</body>
+</html>"""
+
+def _write_pdf_bytes_xhtml2pdf(markdown_text, destination):
+    html = _PDF_HTML_TMPL.format(
+        destination=destination,
+        meta=f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M')}",
+        body=markdown2.markdown(markdown_text),
+    )
+    buf = io.BytesIO()
+    result = pisa.CreatePDF(html, dest=buf)
+    if result.err:
+        raise RuntimeError(f"xhtml2pdf reported {result.err} error(s).")
+    return buf.getvalue()
+
+def write_pdf_bytes(markdown_text, destination):
+    """
+    Build the PDF entirely in memory and return its bytes — no temp file,
+    so concurrent users can't clobber each other's downloads. Prefers the
+    HTML pipeline when available, falling back to ReportLab flowables.
+    """
+    if _HAS_XHTML2PDF:
+        try:
+            return _write_pdf_bytes_xhtml2pdf(markdown_text, destination)
+        except Exception:
+            pass  # fall through to the ReportLab path
     # Letter with 0.5" left/right margins (and ~0.7" top/bottom)
+    buf = io.BytesIO()
     doc = SimpleDocTemplate(
-        filename,
+        buf,
         pagesize=LETTER,
         leftMargin=0.5 * inch,
         rightMargin=0.5 * inch,
@@ -254,24 +1067,15 @@ def write_pdf(markdown_text, destination, filename="travel_plan.pdf"):
         title=f"Travel Guide - {destination}",
         author="Travel Guide Generator",
     )
-    styles = getSampleStyleSheet()
-    
-    header = ParagraphStyle(
-        "Header",
-        parent=styles["Title"],
-        fontSize=18,
-        spaceAfter=12,
-    )
-    
     story = []
-    story.append(Paragraph(f"Travel Guide: {destination}", header))
+    story.append(Paragraph(f"Travel Guide: {destination}", _HEADER))
     meta = f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M')}"
-    story.append(Paragraph(meta, styles["Normal"]))
+    story.append(Paragraph(meta, _STYLES["Normal"]))
     story.append(Spacer(1, 10))
-    
-    story.extend(markdown_to_flowables(markdown_text, styles))
+
+    story.extend(markdown_to_flowables(markdown_text))
     doc.build(story)
-    return filename
+    return buf.getvalue()
 
 # -------------------------
 # INPUT FORM
@@ -321,58 +1125,119 @@ with st.expander("Diagnostics (optional)", expanded=False):
         except Exception as e:
             st.error(f"Self-test failed: {e}")
 
+# -------------------------
+# RESULT FRAGMENTS
+# -------------------------
+# Fragments re-render in isolation: clicking Reset, the self-test, or the
+# download button no longer re-parses and re-diffs the full 1500-word plan
+# markdown on every script rerun. Requires Streamlit >= 1.33.
+@st.fragment
+def _render_saved_plan(title):
+    st.subheader(title)
+    st.markdown(st.session_state["travel_plan"], unsafe_allow_html=False)
+
+@st.fragment
+def _render_raw_text():
+    with st.expander("Show raw text (copy-friendly)"):
+        st.text_area("Plan (raw)", st.session_state["travel_plan"], height=400)
+
+@st.fragment
+def _render_download():
+    # Most sessions only read the plan on screen, so the PDF is built
+    # lazily: nothing renders until "Prepare PDF" is clicked, and the click
+    # reruns just this fragment. Bytes are kept per plan text so a new
+    # generation invalidates the stale document.
+    if st.session_state.get("_pdf_plan") != st.session_state["travel_plan"]:
+        st.session_state.pop("_pdf_bytes", None)
+
+    if "_pdf_bytes" not in st.session_state:
+        if not st.button("📄 Prepare PDF"):
+            return
+        try:
+            st.session_state["_pdf_bytes"] = write_pdf_bytes(
+                st.session_state["travel_plan"],
+                st.session_state["destination"],
+            )
+            st.session_state["_pdf_plan"] = st.session_state["travel_plan"]
+            _trip_cache_put_pdf(st.session_state["_pdf_bytes"])
+        except Exception as e:
+            st.error(f"PDF generation error: {e}")
+            st.info("You can still copy the plan above while we sort out PDF export.")
+            return
+
+    st.download_button(
+        label="⬇️ Download Travel Plan PDF",
+        data=st.session_state["_pdf_bytes"],
+        file_name=f"travel_guide_{st.session_state['destination'].replace(' ', '_').replace(',', '')}.pdf",
+        mime="application/pdf",
+    )
+
 # -------------------------
 # MAIN ACTION
 # -------------------------
 if submitted:
     if not (st.session_state["destination"] and st.session_state["num_days"]):
         st.warning("Please provide at least **Destination** and **Number of Days**.")
+    elif (trip_entry := _trip_cache_get()) and trip_entry.get("markdown"):
+        # Whole-trip cache hit: skip the LLM and the PDF engine entirely.
+        st.session_state["travel_plan"] = trip_entry["markdown"]
+        st.session_state["last_model_used"] = f"{trip_entry.get('model', 'unknown')} (trip cache)"
+        st.session_state["last_usage"] = None
+        if trip_entry.get("pdf"):
+            st.session_state["_pdf_bytes"] = trip_entry["pdf"]
+            st.session_state["_pdf_plan"] = trip_entry["markdown"]
+
+        st.success("✅ Travel plan ready!")
+        st.caption(f"Model: {st.session_state['last_model_used']}")
+        _render_saved_plan(f"Your Travel Plan for {st.session_state['destination']}")
+        _render_raw_text()
+        _render_download()
     else:
-        with st.spinner("Creating your personalized travel plan..."):
-            user_prompt = build_user_prompt(
-                st.session_state["destination"],
-                st.session_state["num_days"],
-                st.session_state["special_interests"],
-                st.session_state["guardrails"],
-            )
-            st.session_state["travel_plan"] = get_travel_plan_markdown(user_prompt)
-        
+        user_prompt = build_user_prompt(
+            st.session_state["destination"],
+            st.session_state["num_days"],
+            st.session_state["special_interests"],
+            st.session_state["guardrails"],
+        )
+
+        # Stream tokens into a placeholder so the user reads while the
+        # model writes, instead of staring at a spinner for the full plan.
+        status = st.empty()
+        status.info("Creating your personalized travel plan...")
+        st.subheader(f"Your Travel Plan for {st.session_state['destination']}")
+        placeholder = st.empty()
+        buf = []
+        for chunk in stream_travel_plan_auto(user_prompt, st.session_state["num_days"]):
+            buf.append(chunk)
+            placeholder.markdown("".join(buf), unsafe_allow_html=False)
+        st.session_state["travel_plan"] = "".join(buf)
+
         if st.session_state["travel_plan"].strip():
-            st.success("✅ Travel plan generated!")
-            st.caption(f"Model: {st.session_state.get('last_model_used', 'unknown')}")
-            if st.session_state.get("last_usage"):
-                st.caption(f"Usage: {st.session_state['last_usage']}")
-            
-            st.subheader(f"Your Travel Plan for {st.session_state['destination']}")
-            st.markdown(st.session_state["travel_plan"], unsafe_allow_html=False)
-            
-            with st.expander("Show raw text (copy-friendly)"):
-                st.text_area("Plan (raw)", st.session_state["travel_plan"], height=400)
-            
-            # PDF export
-            try:
-                pdf_path = write_pdf(
+            if st.session_state.pop("_generation_interrupted", False):
+                # partial plan: keep it on screen but don't cache it as a
+                # finished trip
+                status.warning("⚠️ Generation was interrupted — the plan may be incomplete.")
+            else:
+                _trip_cache_put_markdown(
                     st.session_state["travel_plan"],
-                    st.session_state["destination"],
-                    filename="travel_plan.pdf"
+                    st.session_state.get("last_model_used", "unknown"),
                 )
-                with open(pdf_path, "rb") as f:
-                    st.download_button(
-                        label="⬇️ Download Travel Plan PDF",
-                        data=f.read(),
-                        file_name=f"travel_guide_{st.session_state['destination'].replace(' ', '_').replace(',', '')}.pdf",
-                        mime="application/pdf",
-                    )
-            except Exception as e:
-                st.error(f"PDF generation error: {e}")
-                st.info("You can still copy the plan above while we sort out PDF export.")
+                status.success("✅ Travel plan generated!")
+            st.caption(f"Model: {st.session_state.get('last_model_used', 'unknown')}")
+            if st.session_state.get("last_usage"):
+                st.caption(f"Usage: {_format_usage(st.session_state['last_usage'])}")
+
+            _render_raw_text()
+
+            # PDF export (built on demand)
+            _render_download()
         else:
-            st.warning("The model returned an empty response.")
+            status.warning("The model returned an empty response.")
             st.info("Try again, or verify your API key/model access in Diagnostics above.")
 else:
     if "travel_plan" in st.session_state and st.session_state["travel_plan"].strip():
-        st.subheader("Last Generated Travel Plan")
-        st.markdown(st.session_state["travel_plan"], unsafe_allow_html=False)
+        _render_saved_plan("Last Generated Travel Plan")
+        _render_download()
     else:
         st.info("Fill in the fields above and click **Generate Travel Plan**.")
 